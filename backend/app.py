@@ -1,8 +1,15 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import io
+import numba
 import numpy as np
+import scipy.fft
 import scipy.signal as signal
+import scipy.sparse
+import soundfile as sf
+import threading
 import warnings
 import os
 from stream_chat import StreamChat
@@ -12,6 +19,12 @@ warnings.filterwarnings('ignore')
 
 app = Flask(__name__)
 
+# Reject oversized uploads before they are buffered (Werkzeug enforces this while parsing)
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+# Decoded-sample budget: what a MAX_FILE_SIZE upload of 16-bit PCM holds
+MAX_DECODED_SAMPLES = MAX_FILE_SIZE // 2
+
 # Configure CORS - Allow all origins in development, or specify allowed origins via environment variable
 # In production, set ALLOWED_ORIGINS to your Vercel domain, e.g., "https://your-app.vercel.app"
 allowed_origins = os.environ.get('ALLOWED_ORIGINS', '*')
@@ -27,28 +40,137 @@ STREAM_API_SECRET = "kpfebwva7mvhp3wwwv8cynfgeemdrf7wkrexszr8zhz4p8nj2gnjr5jy4ta
 # Initialize Stream Chat server client
 stream_client = StreamChat(api_key=STREAM_API_KEY, api_secret=STREAM_API_SECRET)
 
+# Feature groups selectable via /extract_features?features=...; all are computed by default
+FEATURE_GROUPS = frozenset({"basic", "mfcc", "pitch", "formants", "jitter"})
+# Values reported for feature groups that were skipped or failed
+BASIC_DEFAULTS = {"rms": 0.0, "zcr": 0.0, "spectralCentroid": 0.0, "spectralFlatness": 0.0}
+PRAAT_DEFAULTS = {
+	"f0_mean": 0.0,
+	"f0_range": 0.0,
+	"jitter": 0.0,
+	"shimmer": 0.0,
+	"f1": 0.0,
+	"f2": 0.0,
+	"speech_rate": 0.0,
+}
+
+# Threads per scipy.fft call. Parallelism comes from gunicorn worker processes (see start.py),
+# so per-request FFTs stay single-threaded by default to avoid oversubscribing cores
+FFT_WORKERS = int(os.environ.get('FFT_WORKERS', '1'))
+
+# Analysis frame step shared by the Praat pitch and formant tracks
+TIME_STEP_S = 0.01
+
+# Number of STFT frames transformed per batch in compute_mfcc (bounds peak memory on long uploads)
+MFCC_CHUNK_FRAMES = 256
+
+# Worker threads for running the independent feature extractors of a request concurrently
+feature_executor = ThreadPoolExecutor(max_workers=3)
+
+
+# Per-thread scratch buffers reused across requests (see _arena)
+_arena_local = threading.local()
+# Largest pooled buffer (in float32 elements, 4 MB); bigger requests get a one-off allocation
+ARENA_MAX_CAPACITY = 1 << 20
+
+
+def _arena(n: int) -> np.ndarray:
+	"""Return a float32 scratch buffer of length n owned by the calling thread.
+
+	Buffers are pooled by power-of-two capacity, so the contents are only valid
+	until the next _arena call on the same thread. Sizes above ARENA_MAX_CAPACITY
+	are not pooled, so a single long upload cannot pin memory in every thread.
+	"""
+	capacity = 1 << max(n - 1, 0).bit_length()
+	if capacity > ARENA_MAX_CAPACITY:
+		return np.empty(n, dtype=np.float32)
+	buffers = getattr(_arena_local, "buffers", None)
+	if buffers is None:
+		buffers = _arena_local.buffers = {}
+	buf = buffers.get(capacity)
+	if buf is None:
+		buf = buffers[capacity] = np.empty(capacity, dtype=np.float32)
+	return buf[:n]
+
+
+def _hann(n: int) -> tuple[np.ndarray, float]:
+	"""Return a periodic float32 Hann window of length n and the one-sided spectrum scaling for its rfft."""
+	window = signal.get_window("hann", n).astype(np.float32)
+	# Bins other than DC (and Nyquist for even n) carry their mirrored negative-frequency power
+	scale = 2.0 / np.sum(window, dtype=np.float64) ** 2
+	return window, scale
+
+
+@functools.lru_cache(maxsize=4)
+def _frame_window(n: int) -> np.ndarray:
+	"""Hann window for fixed STFT frame lengths, cached since every request reuses it."""
+	window, _ = _hann(n)
+	window.setflags(write=False)
+	return window
+
+
+@numba.njit(cache=True, fastmath=True, nogil=True)
+def _centroid_flatness(freqs: np.ndarray, psd: np.ndarray) -> tuple[float, float]:
+	"""Spectral centroid and flatness of a non-negative PSD in a single pass."""
+	n = psd.size
+	tiny = 1e-20  # floor for the log so empty bins don't send the geometric mean to 0
+	s = 0.0
+	sum_f = 0.0
+	slog = 0.0
+	for i in range(n):
+		p = psd[i]
+		s += p
+		sum_f += freqs[i] * p
+		slog += np.log(p if p > tiny else tiny)
+	if s <= 0.0:
+		return 0.0, 0.0
+	# Flatness is geometric mean / arithmetic mean
+	return sum_f / s, np.exp(slog / n) / (s / n)
+
+
+@numba.njit(cache=True, fastmath=True, nogil=True)
+def _time_domain(x: np.ndarray) -> tuple[float, float, int]:
+	"""Sum, sum of squares and sign-change count of x in a single pass."""
+	s = 0.0
+	sq = 0.0
+	zc = 0
+	prev_neg = x.size > 0 and np.signbit(x[0])
+	for i in range(x.size):
+		v = x[i]
+		s += v
+		sq += v * v
+		neg = np.signbit(v)
+		zc += neg != prev_neg
+		prev_neg = neg
+	return s, sq, zc
+
 
 def compute_basic_features(samples: np.ndarray, sample_rate: int) -> dict:
 	"""Compute RMS, ZCR, Spectral Centroid, Spectral Flatness from mono PCM samples."""
-	# Ensure float64 for calculations
-	x = samples.astype(np.float64)
-	# RMS
-	rms = float(np.sqrt(np.mean(np.square(x)))) if x.size > 0 else 0.0
-	# ZCR
-	zero_crossings = np.sum(np.abs(np.diff(np.signbit(x))))
-	zcr = float(zero_crossings) / float(x.size - 1) if x.size > 1 else 0.0
-	# Power spectrum for spectral features
+	# float32 is plenty for these features and halves the memory traffic
+	x = np.ascontiguousarray(samples, dtype=np.float32)
 	if x.size == 0:
-		return {"rms": 0.0, "zcr": 0.0, "spectralCentroid": 0.0, "spectralFlatness": 0.0}
-	# Use periodogram for stable estimate
-	freqs, psd = signal.periodogram(x, fs=sample_rate, scaling="spectrum", window="hann")
-	psd = np.maximum(psd, 1e-20)  # avoid log(0)
-	# Spectral centroid
-	centroid = float(np.sum(freqs * psd) / np.sum(psd)) if np.sum(psd) > 0 else 0.0
-	# Spectral flatness (geometric mean / arithmetic mean)
-	geom_mean = float(np.exp(np.mean(np.log(psd))))
-	arith_mean = float(np.mean(psd)) if psd.size > 0 else 0.0
-	flatness = float(geom_mean / arith_mean) if arith_mean > 0 else 0.0
+		return dict(BASIC_DEFAULTS)
+	# Mean, RMS and zero crossings from one pass over the samples
+	total, sum_sq, zero_crossings = _time_domain(x)
+	rms = float(np.sqrt(sum_sq / x.size))
+	zcr = float(zero_crossings) / float(x.size - 1) if x.size > 1 else 0.0
+	# Hann-windowed power spectrum (equivalent to signal.periodogram with scaling="spectrum")
+	window, scale = _hann(x.size)
+	windowed = np.subtract(x, np.float32(total / x.size), out=_arena(x.size))
+	windowed *= window
+	X = scipy.fft.rfft(windowed, workers=FFT_WORKERS, overwrite_x=True)
+	psd = X.real**2 + X.imag**2
+	psd *= scale
+	# DC (and Nyquist for even lengths) are not mirrored in the one-sided spectrum
+	psd[0] /= 2.0
+	if x.size % 2 == 0:
+		psd[-1] /= 2.0
+	freqs = scipy.fft.rfftfreq(x.size, d=1.0 / sample_rate)
+	# Spectral centroid and flatness
+	centroid, flatness = _centroid_flatness(freqs, psd)
+	centroid = float(centroid)
+	flatness = float(flatness)
 	return {
 		"rms": rms,
 		"zcr": zcr,
@@ -57,22 +179,27 @@ def compute_basic_features(samples: np.ndarray, sample_rate: int) -> dict:
 	}
 
 
-def extract_praat_features(samples: np.ndarray, sample_rate: int) -> dict:
-	"""Extract advanced voice features using Praat/Parselmouth."""
+def extract_praat_features(sound: parselmouth.Sound, features: frozenset = FEATURE_GROUPS) -> dict:
+	"""Extract advanced voice features using Praat/Parselmouth.
+
+	Only the Praat analyses needed for the requested feature groups are run; the
+	rest are reported as 0.0. Jitter/shimmer reuse the pitch track, so requesting
+	"jitter" also fills in the F0 statistics.
+	"""
 	try:
-		# Create Praat Sound object from numpy array
-		sound = parselmouth.Sound(samples, sampling_frequency=sample_rate)
 		duration = sound.duration
 		
 		# Extract Pitch (F0)
-		pitch = sound.to_pitch_ac(
-			time_step=0.01,
-			pitch_floor=75.0,
-			pitch_ceiling=600.0
-		)
+		pitch = None
+		if "pitch" in features or "jitter" in features:
+			pitch = sound.to_pitch_ac(
+				time_step=TIME_STEP_S,
+				pitch_floor=75.0,
+				pitch_ceiling=600.0
+			)
 		
 		# Get F0 statistics
-		f0_values = []
+		f0_values = np.empty(0)
 		f0_mean = 0.0
 		f0_std = 0.0
 		f0_min = 0.0
@@ -80,18 +207,15 @@ def extract_praat_features(samples: np.ndarray, sample_rate: int) -> dict:
 		f0_range = 0.0
 		
 		if pitch:
-			# Extract F0 values (excluding unvoiced frames)
-			for t in np.arange(0, duration, 0.01):
-				f0 = pitch.get_value_at_time(t)
-				if f0 is not None and f0 > 0:
-					f0_values.append(f0)
+			# Extract F0 values for all frames at once (unvoiced frames are 0)
+			f0_values = pitch.selected_array['frequency']
+			f0_values = f0_values[f0_values > 0]
 			
 			if len(f0_values) > 0:
-				f0_array = np.array(f0_values)
-				f0_mean = float(np.mean(f0_array))
-				f0_std = float(np.std(f0_array))
-				f0_min = float(np.min(f0_array))
-				f0_max = float(np.max(f0_array))
+				f0_mean = float(np.mean(f0_values))
+				f0_std = float(np.std(f0_values))
+				f0_min = float(np.min(f0_values))
+				f0_max = float(np.max(f0_values))
 				f0_range = f0_max - f0_min
 			else:
 				f0_mean = 0.0
@@ -101,25 +225,23 @@ def extract_praat_features(samples: np.ndarray, sample_rate: int) -> dict:
 			f0_range = 0.0
 		
 		# Extract Formants (F1, F2)
-		formant = sound.to_formant_burg(
-			time_step=0.01,
-			max_number_of_formants=5.0,
-			maximum_formant=5500.0
-		)
+		formant = None
+		if "formants" in features:
+			formant = sound.to_formant_burg(
+				time_step=TIME_STEP_S,
+				max_number_of_formants=5.0,
+				maximum_formant=5500.0
+			)
 		
-		f1_values = []
-		f2_values = []
 		f1_mean = 0.0
 		f2_mean = 0.0
 		
 		if formant:
-			for t in np.arange(0, duration, 0.01):
-				f1 = formant.get_value_at_time(formant_number=1, time=t)
-				f2 = formant.get_value_at_time(formant_number=2, time=t)
-				if f1 is not None and f1 > 0:
-					f1_values.append(f1)
-				if f2 is not None and f2 > 0:
-					f2_values.append(f2)
+			# Read each formant track as a Matrix row; undefined frames are masked out
+			f1_values = parselmouth.praat.call(formant, "To Matrix", 1).values[0]
+			f2_values = parselmouth.praat.call(formant, "To Matrix", 2).values[0]
+			f1_values = f1_values[f1_values > 0]
+			f2_values = f2_values[f2_values > 0]
 			
 			if len(f1_values) > 0:
 				f1_mean = float(np.mean(f1_values))
@@ -132,8 +254,10 @@ def extract_praat_features(samples: np.ndarray, sample_rate: int) -> dict:
 		shimmer = 0.0
 		
 		try:
-			# Create PointProcess using Praat script
-			point_process = parselmouth.praat.call(sound, "To PointProcess (periodic, cc)", 75.0, 600.0)
+			# Create PointProcess from the Sound and the Pitch computed above, so Praat
+			# does not run a second pitch analysis internally
+			if "jitter" in features:
+				point_process = parselmouth.praat.call([sound, pitch], "To PointProcess (cc)")
 			
 			if point_process:
 				n_pulses = parselmouth.praat.call(point_process, "Get number of points")
@@ -163,7 +287,7 @@ def extract_praat_features(samples: np.ndarray, sample_rate: int) -> dict:
 			# Estimate based on voiced frames and duration
 			# Rough approximation: assume average word length
 			voiced_frames = len(f0_values)
-			voiced_duration = voiced_frames * 0.01
+			voiced_duration = voiced_frames * pitch.time_step
 			# Estimate words per minute (rough heuristic)
 			words_estimate = voiced_duration / 0.5  # Assume ~0.5 seconds per word average
 			speech_rate = float((words_estimate / duration) * 60) if duration > 0 else 0.0
@@ -182,38 +306,82 @@ def extract_praat_features(samples: np.ndarray, sample_rate: int) -> dict:
 	except Exception as e:
 		print(f"Error in Praat extraction: {str(e)}")
 		# Return defaults if Praat extraction fails
-		return {
-			"f0_mean": 0.0,
-			"f0_range": 0.0,
-			"jitter": 0.0,
-			"shimmer": 0.0,
-			"f1": 0.0,
-			"f2": 0.0,
-			"speech_rate": 0.0,
-		}
+		return dict(PRAAT_DEFAULTS)
+
+
+@functools.lru_cache(maxsize=4)
+def _mel_matrix(sample_rate: int, n_fft: int, n_mels: int) -> scipy.sparse.csr_matrix:
+	"""Triangular HTK-mel filterbank of shape (n_mels, n_fft // 2 + 1), built once per configuration."""
+	fft_freqs = scipy.fft.rfftfreq(n_fft, d=1.0 / sample_rate)
+	# Filter corners equally spaced on the mel scale between 0 Hz and Nyquist
+	mel_max = 2595.0 * np.log10(1.0 + (sample_rate / 2.0) / 700.0)
+	hz_points = 700.0 * (10.0 ** (np.linspace(0.0, mel_max, n_mels + 2) / 2595.0) - 1.0)
+	lower = hz_points[:-2, None]
+	center = hz_points[1:-1, None]
+	upper = hz_points[2:, None]
+	rising = (fft_freqs - lower) / (center - lower)
+	falling = (upper - fft_freqs) / (upper - center)
+	weights = np.maximum(0.0, np.minimum(rising, falling)).astype(np.float32)
+	return scipy.sparse.csr_matrix(weights)
 
 
-def compute_mfcc(samples: np.ndarray, sample_rate: int, num_coeffs: int = 13) -> list[float]:
-	"""Compute MFCCs using scipy FFT and mel filterbank."""
+def compute_mfcc(samples: np.ndarray, sample_rate: int, num_coeffs: int = 13, num_mels: int = 26) -> list[float]:
+	"""Compute MFCCs over 25 ms / 10 ms Hann frames and return their mean."""
 	try:
-		# Simple MFCC-like features using FFT and mel-scale approximation
-		fft = np.fft.fft(samples)
-		magnitude = np.abs(fft[:len(fft)//2])
+		if samples.size == 0:
+			return [0.0] * num_coeffs
+		frame_length = int(round(0.025 * sample_rate))
+		hop_length = int(round(0.010 * sample_rate))
+		n_fft = 1 << (frame_length - 1).bit_length()
+		x = np.ascontiguousarray(samples, dtype=np.float32)
+		if x.size < frame_length:
+			x = np.pad(x, (0, frame_length - x.size))
 		
-		# Simple mel-like filterbank approximation
-		mfccs = []
-		for i in range(num_coeffs):
-			start = int((i * len(magnitude)) / num_coeffs)
-			end = int(((i + 1) * len(magnitude)) / num_coeffs)
-			coeff = float(np.mean(magnitude[start:end])) if end > start else 0.0
-			mfccs.append(coeff)
+		# Strided view of all frames; only one chunk of them is materialized at a time
+		frames = np.lib.stride_tricks.sliding_window_view(x, frame_length)[::hop_length]
+		window = _frame_window(frame_length)
+		mel_matrix = _mel_matrix(sample_rate, n_fft, num_mels)
+		mfcc_sum = np.zeros(num_mels, dtype=np.float64)
+		for start in range(0, len(frames), MFCC_CHUNK_FRAMES):
+			block = frames[start:start + MFCC_CHUNK_FRAMES]
+			chunk = np.multiply(block, window, out=_arena(block.size).reshape(block.shape))
+			spectrum = scipy.fft.rfft(chunk, n=n_fft, axis=1, workers=FFT_WORKERS, overwrite_x=True)
+			power = spectrum.real**2 + spectrum.imag**2
+			# Log mel energies per frame (one column each), decorrelated with a DCT-II
+			log_mel = np.log(mel_matrix @ power.T + 1e-10)
+			mfcc_sum += scipy.fft.dct(log_mel, type=2, norm="ortho", axis=0).sum(axis=1)
 		
+		mfccs = (mfcc_sum / len(frames))[:num_coeffs].tolist()
 		return mfccs
 	except:
 		# Fallback to zeros if computation fails
 		return [0.0] * num_coeffs
 
 
+def _analyze(samples: np.ndarray, sample_rate: int, features: frozenset = FEATURE_GROUPS) -> tuple[dict, list[float], dict]:
+	"""Run the extractors for the requested feature groups; returns (basic, mfcc, praat_features)."""
+	# Run the extractors concurrently; Praat is submitted first as it takes longest
+	# Advanced Praat features (F0, jitter, shimmer, formants)
+	praat_future = None
+	if features & {"pitch", "formants", "jitter"}:
+		# Build the Praat Sound once, from a contiguous float64 buffer (Praat's native sample type)
+		sound = parselmouth.Sound(np.ascontiguousarray(samples, dtype=np.float64), sampling_frequency=sample_rate)
+		praat_future = feature_executor.submit(extract_praat_features, sound, features)
+	# Basic features (RMS, ZCR, Spectral features, MFCC)
+	basic_future = feature_executor.submit(compute_basic_features, samples, sample_rate) if "basic" in features else None
+	mfcc_future = feature_executor.submit(compute_mfcc, samples, sample_rate, num_coeffs=13) if "mfcc" in features else None
+	
+	basic = basic_future.result() if basic_future else dict(BASIC_DEFAULTS)
+	mfcc = mfcc_future.result() if mfcc_future else [0.0] * 13
+	praat_features = praat_future.result() if praat_future else dict(PRAAT_DEFAULTS)
+	return basic, mfcc, praat_features
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+	return jsonify({"error": f"file too large (max {MAX_FILE_SIZE // (1024 * 1024)} MB)"}), 413
+
+
 @app.route("/health", methods=["GET"])  # simple health check
 def health():
 	return jsonify({"status": "ok"})
@@ -250,26 +418,52 @@ def generate_stream_token():
 
 @app.route("/extract_features", methods=["POST"])
 def extract_features():
-	"""Accept a WAV file and return features computed with Praat/Parselmouth."""
+	"""Accept a WAV file and return features computed with Praat/Parselmouth.
+
+	An optional ?features=basic,mfcc,pitch,formants,jitter query parameter limits
+	which feature groups are computed; skipped groups are returned as zeros.
+	"""
+	requested = request.args.get("features")
+	if requested is not None:
+		features = frozenset(name.strip() for name in requested.split(",") if name.strip())
+		if not features:
+			return jsonify({"error": "features must name at least one of: " + ", ".join(sorted(FEATURE_GROUPS))}), 400
+		unknown = features - FEATURE_GROUPS
+		if unknown:
+			return jsonify({"error": f"unknown feature groups: {', '.join(sorted(unknown))}"}), 400
+	else:
+		features = FEATURE_GROUPS
+	# Check the declared size before touching the body
+	if request.content_length and request.content_length > MAX_FILE_SIZE:
+		return request_too_large(None)
 	if "file" not in request.files:
 		return jsonify({"error": "file field missing"}), 400
 	file = request.files["file"]
-	data = file.read()
-	if not data:
+	# Werkzeug has already spooled the upload; check its size without reading it into memory
+	stream = file.stream
+	stream.seek(0, io.SEEK_END)
+	if stream.tell() == 0:
 		return jsonify({"error": "empty file"}), 400
+	stream.seek(0)
 	try:
-		# Simple WAV file reading (assumes 16-bit PCM, mono)
-		# Skip WAV header (44 bytes) and read audio data
-		audio_data = data[44:]
-		samples = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
-		sample_rate = 16000  # Assuming 16kHz as per our conversion
-		
-		# Compute basic features (RMS, ZCR, Spectral features, MFCC)
-		basic = compute_basic_features(samples, sample_rate)
-		mfcc = compute_mfcc(samples, sample_rate, num_coeffs=13)
+		# libsndfile decodes straight from the upload stream and normalizes to float32 in one call.
+		# Only WAV is accepted: compressed formats could expand to far more samples than the upload size
+		try:
+			with sf.SoundFile(stream) as audio:
+				if audio.format not in ("WAV", "WAVEX"):
+					return jsonify({"error": "only WAV audio is supported"}), 400
+				# Bound the decoded size from the header before reading any samples
+				if audio.frames * audio.channels > MAX_DECODED_SAMPLES:
+					return jsonify({"error": "audio too long"}), 413
+				samples = audio.read(dtype="float32", always_2d=False)
+				sample_rate = audio.samplerate
+		except sf.SoundFileError as e:
+			print(f"Could not decode uploaded audio: {str(e)}")
+			return jsonify({"error": "could not decode audio"}), 400
+		if samples.ndim > 1:
+			samples = samples.mean(axis=1, dtype=np.float32)
 		
-		# Extract advanced Praat features (F0, jitter, shimmer, formants)
-		praat_features = extract_praat_features(samples, sample_rate)
+		basic, mfcc, praat_features = _analyze(samples, sample_rate, features)
 		
 		# Print extracted features to terminal/console
 		print("\n" + "="*50)
@@ -324,4 +518,4 @@ if __name__ == "__main__":
 	import os
 	os.environ['FLASK_SKIP_DOTENV'] = '1'
 	
-	app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
+	app.run(host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1 +1,39 @@
+"""Install backend dependencies and start the feature-extraction server on port 8000."""
+import os
+import subprocess
+import sys
 
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+PORT = 8000
+
+
+def main():
+	os.chdir(BACKEND_DIR)
+	print("Installing dependencies...")
+	subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
+
+	# Disable Flask's automatic .env loading to avoid encoding issues
+	os.environ['FLASK_SKIP_DOTENV'] = '1'
+
+	if os.name == "nt":
+		# Gunicorn does not run on Windows; fall back to Flask's threaded server
+		print(f"Starting Flask server on port {PORT}...")
+		from app import app
+		app.run(host="0.0.0.0", port=PORT, threaded=True)
+		return
+
+	# One process per core; gthread workers keep serving while NumPy/Praat work runs
+	workers = os.cpu_count() or 1
+	print(f"Starting gunicorn on port {PORT} with {workers} workers...")
+	subprocess.check_call([
+		sys.executable, "-m", "gunicorn",
+		"-w", str(workers),
+		"-k", "gthread",
+		"--threads", "2",
+		"-b", f"0.0.0.0:{PORT}",
+		"app:app",
+	])
+
+
+if __name__ == "__main__":
+	main()